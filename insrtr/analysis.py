@@ -82,6 +82,45 @@ def loops_to_0_based(loops):
 import mdtraj as md
 import pandas as pd
 
+# Speed/accuracy tiers for the SASA calculation. `mode` "residue" only keeps per residue SASA,
+# which is enough for all the features, "atom" also keeps the per atom values in `sasa_atoms_A`.
+SASA_TIERS = dict(
+    fast=dict(n_sphere_points=100, mode="residue"),
+    default=dict(n_sphere_points=960, mode="atom"),
+    precise=dict(n_sphere_points=2500, mode="atom"),
+)
+
+
+def aggregate_atom_sasa(topology, sasa_atoms_A):
+    """Sums per atom SASA to per residue SASA"""
+    atom_res_index0 = [atom.residue.index for atom in topology.atoms]
+    return np.bincount(atom_res_index0, weights=sasa_atoms_A, minlength=topology.n_residues)
+
+
+def insertion_wt_to_mut_index0(wt_index0, one_based_position, insert_length):
+    """
+    Returns the zero based mutant index of a wild type residue.
+
+    The insert is placed like in `insert_sequence`, i.e. before the residue at `one_based_position`.
+    """
+    if wt_index0 < one_based_position - 1:
+        return wt_index0
+    return wt_index0 + insert_length
+
+
+def insertion_mut_to_wt_index0(mut_index0, one_based_position, insert_length):
+    """
+    Returns the zero based wild type index of a mutant residue or None if the residue is part of the insert.
+
+    The insert is placed like in `insert_sequence`, i.e. before the residue at `one_based_position`.
+    """
+    insert_start0 = one_based_position - 1
+    if mut_index0 < insert_start0:
+        return mut_index0
+    if mut_index0 < insert_start0 + insert_length:
+        return None
+    return mut_index0 - insert_length
+
 
 class LoopAnalyzer:
     def __init__(
@@ -92,39 +131,56 @@ class LoopAnalyzer:
         always_include_sites1=None,
         include_dssp="LHE",
         skip_ends=True,
+        sasa_tier="default",
     ):
-        self.struct_file_path = struct_file_path
-
-        if struct_name is None:  # If no name given take it from the struct file
-            struct_name = pathlib.Path(struct_file_path).stem
+        assert sasa_tier in SASA_TIERS, f"Unknown SASA tier {sasa_tier}, must be one of {list(SASA_TIERS)}"
+        self.sasa_tier = sasa_tier
 
         if always_include_sites1 is None:
             always_include_sites1 = []
 
-        self.struct_name = str(struct_name)
-        self.traj = md.load(struct_file_path)
-        self.topology = self.traj.topology
+        self.load_structure(struct_file_path, struct_name)
         self.dssp = md.compute_dssp(self.traj, simplified=True)[0]
         self.dssp = np.char.replace(self.dssp, "C", "L")
-        self.seq = "".join(resname_3to1([res.name for res in self.topology.residues]))
         # self.loops = get_loops_from_annotation(self.dssp, loop_char="L", skip_ends=True) + always_include_sites1
-        loop_array = [get_loops_from_annotation(self.dssp, loop_char=dssp_char, skip_ends=skip_ends) for dssp_char in include_dssp]
-        self.loops = list(itertools.chain(*loop_array))
-        # print(self.loops)
-        self.loops0 = loops_to_0_based(self.loops)
-        self.sasa_atoms_A = md.shrake_rupley(self.traj)[0] * 100  # make in in angstrom
-        self.total_sasa_A = sum(self.sasa_atoms_A)
-        self.residue_features_table = None
+        self.find_loops(include_dssp, skip_ends)
+        sasa_A = self.compute_sasa_A(self.traj)
+        if SASA_TIERS[self.sasa_tier]["mode"] == "atom":
+            self.sasa_atoms_A = sasa_A
+            self.sasa_res_A = aggregate_atom_sasa(self.topology, sasa_A)
+        else:
+            self.sasa_atoms_A = None
+            self.sasa_res_A = sasa_A
+        self.total_sasa_A = sum(sasa_A)
         if active_res_index1:
             self.active_res_index0 = [int(resid) - 1 for resid in active_res_index1]
         else:
             self.active_res_index0 = []
 
-    _loop_features = []
-    loop_feature_descriptions = {}
-    _resi_features = []
-    resi_feature_descriptions = {}
-    feature_descriptions_table = None
+    def load_structure(self, struct_file_path, struct_name=None):
+        """Loads the structure and resets the features"""
+        self.struct_file_path = struct_file_path
+
+        if struct_name is None:  # If no name given take it from the struct file
+            struct_name = pathlib.Path(struct_file_path).stem
+
+        self.struct_name = str(struct_name)
+        self.traj = md.load(struct_file_path)
+        self.topology = self.traj.topology
+        self.seq = "".join(resname_3to1([res.name for res in self.topology.residues]))
+
+        self._loop_features = []
+        self.loop_feature_descriptions = {}
+        self._resi_features = []
+        self.resi_feature_descriptions = {}
+        self.feature_descriptions_table = None
+        self.residue_features_table = None
+
+    def find_loops(self, include_dssp="LHE", skip_ends=True):
+        """Finds the loops (segments of each type in `include_dssp`) in the DSSP annotation"""
+        loop_array = [get_loops_from_annotation(self.dssp, loop_char=dssp_char, skip_ends=skip_ends) for dssp_char in include_dssp]
+        self.loops = list(itertools.chain(*loop_array))
+        self.loops0 = loops_to_0_based(self.loops)
 
     def analyze_structure(self):
         """Analyze the structure"""
@@ -145,20 +201,28 @@ class LoopAnalyzer:
 
         return self.residue_features_table
 
+    def compute_sasa_A(self, traj):
+        """Returns the SASA in A**2 per atom or per residue, as set by the SASA tier"""
+        tier = SASA_TIERS[self.sasa_tier]
+        return md.shrake_rupley(traj, n_sphere_points=tier["n_sphere_points"], mode=tier["mode"])[0] * 100  # make in in angstrom
+
     def get_loop_features(self):
         self._loop_features = []
         for li, loop in enumerate(self.loops0):
-            self._loop_features.append(dict(loop_index0=li, loop_length_AA=len(loop)))  # make new dict
-            if li == 0:  # description need to be added on first pass only
-                self.loop_feature_descriptions["loop_index0"] = "The zero based index of the loop."
-                self.loop_feature_descriptions["loop_length_AA"] = "The length of the loop."
-            for loop_analyzer in self._loop_analyzers:
-                res = loop_analyzer(self, li)
-                for f in res.keys():
-                    # add the values and descriptions to different lists
-                    self._loop_features[li][f] = res[f][0]
-                    if li == 0:  # add the description if this is the first loop pass
-                        self.loop_feature_descriptions[f] = res[f][1]
+            self._loop_features.append(self.get_single_loop_features(li))
+
+    def get_single_loop_features(self, loop_index0):
+        """Runs all the loop analyzers on a single loop and returns the features as a dict"""
+        features = dict(loop_index0=loop_index0, loop_length_AA=len(self.loops0[loop_index0]))  # make new dict
+        self.loop_feature_descriptions["loop_index0"] = "The zero based index of the loop."
+        self.loop_feature_descriptions["loop_length_AA"] = "The length of the loop."
+        for loop_analyzer in self._loop_analyzers:
+            res = loop_analyzer(self, loop_index0)
+            for f in res.keys():
+                # add the values and descriptions to different lists
+                features[f] = res[f][0]
+                self.loop_feature_descriptions[f] = res[f][1]
+        return features
 
     def get_loop_geometry(self, loop_index0):
         loop_residues = self.loops0[loop_index0]
@@ -210,12 +274,12 @@ class LoopAnalyzer:
 
         loop_ids = self.topology.select(f"resid {loop_residues[0]} to {loop_residues[-1]}")
 
-        loop_sasa_A = sum(self.sasa_atoms_A[loop_ids])  # get sasa just for loop
+        loop_sasa_A = sum(self.sasa_res_A[loop_residues[0] : loop_residues[-1] + 1])  # get sasa just for loop
         loop_sasa_A_per_res = loop_sasa_A / len(loop_residues)
 
         # get SASA if the loop was on it's own, without the rest of the protein
         loop_isolation_traj = self.traj.atom_slice(loop_ids)
-        loop_isolation_SASA_A = sum(md.shrake_rupley(loop_isolation_traj)[0] * 100)  # make in in angstrom
+        loop_isolation_SASA_A = sum(self.compute_sasa_A(loop_isolation_traj))
         loop_burial_percent = (1 - loop_sasa_A / loop_isolation_SASA_A) * 100
         loop_percent_of_total_surface = loop_sasa_A / self.total_sasa_A * 100
 
@@ -249,21 +313,26 @@ class LoopAnalyzer:
                     dict(struct_name=self.struct_name, resi_loop_index0=ri, loop_index0=li, resi_index0=resi)
                 )  # make new dict
                 if li == 0 and ri == 0:  # description need to be added on first pass only
-                    self.resi_feature_descriptions["struct_name"] = "Name of the structure"
-                    self.resi_feature_descriptions["resi_index0"] = "The zero based index of the residue."
-                    self.resi_feature_descriptions[
-                        "resi_loop_index0"
-                    ] = "The zero based index of the residue inside the loop."
-                    self.resi_feature_descriptions["loop_index0"] = "The zero based index of the loop."
-
-                for resi_analyzer in self._resi_analyzers:
-                    res = resi_analyzer(self, li, ri, loop)
-                    for f in res.keys():
-                        # Add the values and descriptions to different lists
-                        # Append to the last
-                        self._resi_features[-1][f] = res[f][0]
-                        if ri == 0:  # add the description if this is the first loop pass
-                            self.resi_feature_descriptions[f] = res[f][1]
+                    self.add_resi_index_descriptions()
+
+                # Append to the last
+                self.add_resi_features(self._resi_features[-1], self._resi_analyzers, li, ri, loop)
+
+    def add_resi_index_descriptions(self):
+        self.resi_feature_descriptions["struct_name"] = "Name of the structure"
+        self.resi_feature_descriptions["resi_index0"] = "The zero based index of the residue."
+        self.resi_feature_descriptions["resi_loop_index0"] = "The zero based index of the residue inside the loop."
+        self.resi_feature_descriptions["loop_index0"] = "The zero based index of the loop."
+
+    def add_resi_features(self, features, resi_analyzers, loop_index0, resi_loop_index0, loop_residues):
+        """Runs `resi_analyzers` on a single residue and adds the results to the `features` dict"""
+        for resi_analyzer in resi_analyzers:
+            res = resi_analyzer(self, loop_index0, resi_loop_index0, loop_residues)
+            for f in res.keys():
+                # Add the values and descriptions to different lists
+                features[f] = res[f][0]
+                if resi_loop_index0 == 0:  # add the description if this is the first loop pass
+                    self.resi_feature_descriptions[f] = res[f][1]
 
     def get_resi_geometry(self, loop_index0, resi_loop_index0, loop_residues):
         first_CA = self.topology.select(f"resid {loop_residues[0]} and name CA")[0]
@@ -315,11 +384,11 @@ class LoopAnalyzer:
 
         resi_atoms = self.topology.select(f"resid {resi_index0}")
 
-        resi_sasa_A = sum(self.sasa_atoms_A[resi_atoms])  # get sasa just for residue
+        resi_sasa_A = self.sasa_res_A[resi_index0]  # get sasa just for residue
 
         # get SASA if residue  was on it's own, without the rest of the protein
         resi_isolation_traj = self.traj.atom_slice(resi_atoms)
-        resi_isolation_SASA_A = sum(md.shrake_rupley(resi_isolation_traj)[0] * 100)  # make in in angstrom
+        resi_isolation_SASA_A = sum(self.compute_sasa_A(resi_isolation_traj))
         resi_burial_percent = (1 - resi_sasa_A / resi_isolation_SASA_A) * 100
         resi_percent_of_total_surface = resi_sasa_A / self.total_sasa_A * 100
 
@@ -468,3 +537,223 @@ class LoopAnalyzer:
         get_active_seq_res_info,
         get_resi_active_site_dssp_info,
     ]
+
+
+class InsertionDiffAnalyzer(LoopAnalyzer):
+    """
+    Analyzes a mutant that is the wild type with an inserted sequence, reusing the wild type features.
+
+    Only residues within `seq_radius` residues or `spatial_radius_A` of the insert have their DSSP, SASA and
+    loop/residue features recomputed. Everything else is copied from the analyzed wild type, which assumes
+    the structure away from the insert does not change.
+    """
+
+    def __init__(
+        self,
+        wt_analyzer,
+        struct_file_path,
+        one_based_position,
+        insert_length,
+        struct_name=None,
+        seq_radius=4,
+        spatial_radius_A=10.0,
+        context_margin_A=10.0,
+        include_dssp="LHE",
+        skip_ends=True,
+    ):
+        """
+        Parameters
+        ----------
+        wt_analyzer : LoopAnalyzer
+            Analyzer of the wild type structure. Analyzed first if `analyze_structure` was not yet called.
+        struct_file_path : str
+            Path to the mutant structure.
+        one_based_position : int
+            Position of the insert, same as in `insert_sequence`.
+        insert_length : int
+            Number of inserted residues, i.e. `len(insert)`.
+        seq_radius : int, optional
+            Residues closer than this (in number of residues) to the insert are recomputed, by default 4
+        spatial_radius_A : float, optional
+            Residues with an atom closer than this to the insert are recomputed, by default 10.0
+        context_margin_A : float, optional
+            Extra shell of atoms around the recomputed residues used as context for DSSP and SASA, by default 10.0
+        """
+        assert insert_length > 0, "Insert must contain at least one residue"
+        assert seq_radius >= 1, "Features of neighbouring residues require a sequence radius of at least 1"
+
+        self.wt = wt_analyzer
+        if self.wt.residue_features_table is None:
+            self.wt.analyze_structure()
+
+        self.one_based_position = one_based_position
+        self.insert_length = insert_length
+        self.sasa_tier = self.wt.sasa_tier
+
+        self.load_structure(struct_file_path, struct_name)
+        assert (
+            self.topology.n_residues == self.wt.topology.n_residues + insert_length
+        ), "Mutant must be the wild type plus the insert"
+
+        self.recomputed_res_index0 = self.get_recomputed_residues(seq_radius, spatial_radius_A)
+        self.splice_dssp_and_sasa(context_margin_A)
+        self.find_loops(include_dssp, skip_ends)
+        self.active_res_index0 = [self.wt_to_mut_index0(resid) for resid in self.wt.active_res_index0]
+        self.copied_res_index0 = set()
+
+    def wt_to_mut_index0(self, wt_index0):
+        return insertion_wt_to_mut_index0(wt_index0, self.one_based_position, self.insert_length)
+
+    def mut_to_wt_index0(self, mut_index0):
+        return insertion_mut_to_wt_index0(mut_index0, self.one_based_position, self.insert_length)
+
+    def get_recomputed_residues(self, seq_radius, spatial_radius_A):
+        """Returns the set of mutant residue indices whose features can not be taken from the wild type"""
+        n_res = self.topology.n_residues
+        insert_start0 = self.one_based_position - 1
+        insert_end0 = insert_start0 + self.insert_length  # exclusive
+
+        recomputed = set(range(max(0, insert_start0 - seq_radius), min(n_res, insert_end0 + seq_radius)))
+
+        insert_atoms = self.topology.select(f"resid {insert_start0} to {insert_end0 - 1}")
+        near_atoms = md.compute_neighbors(self.traj, spatial_radius_A / 10, insert_atoms)[0]
+        recomputed.update(self.topology.atom(atom).residue.index for atom in near_atoms)
+
+        # residues that do not match the wild type (e.g. point mutations) can not be copied either
+        for res in self.topology.residues:
+            if res.index in recomputed:
+                continue
+            wt_res = self.wt.topology.residue(self.mut_to_wt_index0(res.index))
+            if res.name != wt_res.name or res.n_atoms != wt_res.n_atoms:
+                recomputed.add(res.index)
+
+        return recomputed
+
+    def splice_dssp_and_sasa(self, context_margin_A):
+        """Takes DSSP and SASA from the wild type and recomputes them on a slice around the insert"""
+        recomputed = sorted(self.recomputed_res_index0)
+        region_atoms = np.array([atom.index for r in recomputed for atom in self.topology.residue(r).atoms])
+        context_atoms = md.compute_neighbors(self.traj, context_margin_A / 10, region_atoms)[0]
+        context_res = sorted(set(recomputed) | {self.topology.atom(atom).residue.index for atom in context_atoms})
+        context_atoms = np.array([atom.index for r in context_res for atom in self.topology.residue(r).atoms])
+
+        context_traj = self.traj.atom_slice(context_atoms)
+        context_dssp = md.compute_dssp(context_traj, simplified=True)[0]
+        context_dssp = np.char.replace(context_dssp, "C", "L")
+        context_sasa_A = self.compute_sasa_A(context_traj)
+        atom_mode = SASA_TIERS[self.sasa_tier]["mode"] == "atom"
+        if atom_mode:
+            context_res_sasa_A = aggregate_atom_sasa(context_traj.topology, context_sasa_A)
+        else:
+            context_res_sasa_A = context_sasa_A
+
+        self.dssp = np.empty(self.topology.n_residues, dtype=self.wt.dssp.dtype)
+        self.sasa_res_A = np.empty(self.topology.n_residues)
+        self.sasa_atoms_A = np.empty(self.topology.n_atoms) if atom_mode else None
+        for res in self.topology.residues:
+            if res.index in self.recomputed_res_index0:
+                continue
+            wt_res = self.wt.topology.residue(self.mut_to_wt_index0(res.index))
+            self.dssp[res.index] = self.wt.dssp[wt_res.index]
+            self.sasa_res_A[res.index] = self.wt.sasa_res_A[wt_res.index]
+            if atom_mode:
+                self.sasa_atoms_A[[atom.index for atom in res.atoms]] = self.wt.sasa_atoms_A[[atom.index for atom in wt_res.atoms]]
+
+        context_res_pos = {r: pos for pos, r in enumerate(context_res)}
+        for r in recomputed:
+            self.dssp[r] = context_dssp[context_res_pos[r]]
+            self.sasa_res_A[r] = context_res_sasa_A[context_res_pos[r]]
+        if atom_mode:
+            # context_atoms is sorted, so searchsorted gives the position of each atom in the slice
+            self.sasa_atoms_A[region_atoms] = context_sasa_A[np.searchsorted(context_atoms, region_atoms)]
+        self.total_sasa_A = sum(self.sasa_res_A)
+
+    def get_wt_loop_index0(self, loop_residues):
+        """Returns the index of the identical wild type loop or None if the loop must be recomputed"""
+        # the residue features also read the residues flanking the loop
+        if any(resi in self.recomputed_res_index0 for resi in range(loop_residues[0] - 1, loop_residues[-1] + 2)):
+            return None
+        wt_loop = [self.mut_to_wt_index0(resi) for resi in loop_residues]
+        for wt_li, loop in enumerate(self.wt.loops0):
+            if loop == wt_loop:
+                return wt_li
+        return None
+
+    def get_loop_features(self):
+        # the fraction of the total surface changes with the insert, so rescale the copied values
+        sasa_scale = self.wt.total_sasa_A / self.total_sasa_A
+        # copied loops do not pass through the analyzers, so take their descriptions from the wild type
+        self.loop_feature_descriptions.update(self.wt.loop_feature_descriptions)
+        self._loop_features = []
+        self._wt_loop_index0 = []
+        for li, loop in enumerate(self.loops0):
+            wt_li = self.get_wt_loop_index0(loop)
+            self._wt_loop_index0.append(wt_li)
+            if wt_li is None:
+                self._loop_features.append(self.get_single_loop_features(li))
+                continue
+            features = dict(self.wt._loop_features[wt_li])
+            features["loop_index0"] = li
+            features["loop_percent_of_total_surface"] *= sasa_scale
+            self._loop_features.append(features)
+
+    def get_resi_features(self):
+        sasa_scale = self.wt.total_sasa_A / self.total_sasa_A
+        wt_rows = {row["resi_index0"]: row for row in self.wt._resi_features}
+        self.add_resi_index_descriptions()
+        self.resi_feature_descriptions.update(self.wt.resi_feature_descriptions)
+        self._resi_features = []
+        self.copied_res_index0 = set()
+        for li, loop in enumerate(self.loops0):
+            for ri, resi in enumerate(loop):
+                indices = dict(struct_name=self.struct_name, resi_loop_index0=ri, loop_index0=li, resi_index0=resi)
+                if self._wt_loop_index0[li] is None:
+                    features = indices
+                    self.add_resi_features(features, self._resi_analyzers, li, ri, loop)
+                else:
+                    features = dict(wt_rows[self.mut_to_wt_index0(resi)])
+                    features.update(indices)
+                    features["resi_percent_of_total_surface"] *= sasa_scale
+                    self.add_resi_features(features, self.get_changed_active_site_analyzers(resi), li, ri, loop)
+                    self.copied_res_index0.add(resi)
+                self._resi_features.append(features)
+
+    def get_changed_active_site_analyzers(self, resi_index0):
+        """
+        Returns the active site analyzers whose result can differ from the wild type for a copied residue.
+
+        Distances only change if an active site residue was recomputed. Sequence distances and DSSP counts
+        only change if a recomputed residue (e.g. the insert) lies between the residue and an active site.
+        """
+        analyzers = []
+        if any(active in self.recomputed_res_index0 for active in self.active_res_index0):
+            analyzers.append(LoopAnalyzer.get_active_geometry_res_info)
+        for active in self.active_res_index0:
+            start, end = sorted((active, resi_index0))
+            if any(start < resi < end for resi in self.recomputed_res_index0):
+                analyzers += [LoopAnalyzer.get_active_seq_res_info, LoopAnalyzer.get_resi_active_site_dssp_info]
+                break
+        return analyzers
+
+    def get_feature_deltas(self):
+        """Returns the per residue difference (mutant - wild type) of all numeric features"""
+        if self.residue_features_table is None:
+            self.analyze_structure()
+
+        mut_table = self.residue_features_table
+        wt_table = self.wt.residue_features_table.set_index("resi_index0")
+        wt_index0 = [self.mut_to_wt_index0(resi) for resi in mut_table.resi_index0]
+        # inserted residues have no wild type counterpart and get NaN deltas
+        wt_values = wt_table.reindex([-1 if resi is None else resi for resi in wt_index0])
+
+        deltas = mut_table[["struct_name", "resi_index0", "loop_index0"]].copy()
+        deltas["wt_resi_index0"] = pd.array(wt_index0, dtype="Int64")
+        deltas["recomputed"] = ~mut_table.resi_index0.isin(self.copied_res_index0).values
+
+        index_columns = ["resi_index0", "resi_loop_index0", "loop_index0"]
+        for f in mut_table.select_dtypes("number").columns:
+            if f in index_columns or f not in wt_values.columns:
+                continue
+            deltas[f + "_delta"] = mut_table[f].values - pd.to_numeric(wt_values[f], errors="coerce").values
+
+        return deltas
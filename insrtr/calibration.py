@@ -0,0 +1,170 @@
+"""
+Calibration of the SASA tiers against the default tier.
+
+Measures how much the SASA features drift and how the predicted ranking changes when a faster
+(or more precise) tier is used. The model needs active sites, which are read from `active-sites.csv`
+(columns struct_name and space separated active_res_index1). Run on the bundled structures with::
+
+    python -m insrtr.calibration data/pdbs/wt
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from .analysis import SASA_TIERS, LoopAnalyzer
+from .model import load_model, prepare_features, rank_predictions
+
+
+def is_sasa_feature(feature):
+    """True for features that depend on the SASA calculation"""
+    return any(key in feature.lower() for key in ("sasa", "burial", "surface"))
+
+
+def read_active_sites(file_path):
+    """Reads a csv with struct_name and active_res_index1 columns into a dict of active site lists"""
+    table = pd.read_csv(file_path, dtype=str)
+    return {row.struct_name: [int(resid) for resid in row.active_res_index1.split()] for row in table.itertuples()}
+
+
+def score_features(df, model, n_top, exclude_resi_index1=[]):
+    """Returns the n_top predictions and the probability of each residue being a good insertion site"""
+    df = df.copy()
+    x = prepare_features(df, exclude_resi_index1)
+    df_predictions = rank_predictions(df, model.predict(x), model.predict_proba(x), n_top)
+    return df_predictions, df.set_index("resi_index0")["probability_Y"]
+
+
+def calibrate_sasa_tiers(
+    struct_file_paths, active_sites, tiers=None, reference_tier="default", model_path=None, n_top=3, n_repeats=3
+):
+    """
+    Analyzes the structures with each SASA tier and compares them to the reference tier.
+
+    Parameters
+    ----------
+    struct_file_paths: list of structure files
+    active_sites: dict of struct_name (file stem) to active site residues (1 based), excluded from the predictions
+    tiers: names of the tiers to compare, by default all tiers except the reference
+    reference_tier: tier to compare against
+    model_path: path to trained model, by default the packaged model
+    n_top: the number of top positions compared between tiers
+    n_repeats: number of timed analyses per tier, the fastest one is reported
+
+    Returns
+    -------
+    dataframe with one row per structure and tier, containing the (minimum) analysis time, speedup,
+    mean and max absolute drift of each SASA feature, the overlap of the n_top predictions
+    and the Spearman correlation of the predicted probabilities
+    """
+    if tiers is None:
+        tiers = SASA_TIERS
+    tiers = [tier for tier in tiers if tier != reference_tier]
+    if model_path is None:
+        from . import MODEL_NAME
+
+        model_path = pathlib.Path(__file__).parent / "models" / MODEL_NAME
+    model = load_model(model_path)
+
+    rows = []
+    for struct_file_path in struct_file_paths:
+        struct_name = pathlib.Path(struct_file_path).stem
+        active_res_index1 = active_sites[struct_name]
+        all_tiers = [reference_tier] + list(tiers)
+        # untimed warm-up, so the cold file cache and first DSSP/SASA calls are not charged to the first tier
+        LoopAnalyzer(struct_file_path, active_res_index1=active_res_index1, sasa_tier=reference_tier).analyze_structure()
+
+        tables = {}
+        times_s = {tier: [] for tier in all_tiers}
+        for repeat in range(n_repeats):
+            # alternate the order, so no tier always runs first
+            for tier in all_tiers if repeat % 2 == 0 else all_tiers[::-1]:
+                start = time.perf_counter()
+                analyzer = LoopAnalyzer(struct_file_path, active_res_index1=active_res_index1, sasa_tier=tier)
+                tables[tier] = analyzer.analyze_structure()
+                times_s[tier].append(time.perf_counter() - start)
+        times_s = {tier: min(tier_times_s) for tier, tier_times_s in times_s.items()}
+
+        # the model depends on the column order, so only index by residue for the comparison
+        reference_predictions, reference_probability = score_features(
+            tables[reference_tier], model, n_top, active_res_index1
+        )
+        reference = tables[reference_tier].set_index("resi_index0")
+        sasa_features = [f for f in reference.select_dtypes("number").columns if is_sasa_feature(f)]
+
+        for tier in tiers:
+            table = tables[tier].set_index("resi_index0").reindex(reference.index)
+            row = dict(
+                struct_name=struct_name,
+                sasa_tier=tier,
+                analysis_time_s=times_s[tier],
+                speedup=times_s[reference_tier] / times_s[tier],
+            )
+            for f in sasa_features:
+                drift = np.abs(table[f] - reference[f])
+                row[f + "_mean_abs_drift"] = drift.mean()
+                row[f + "_max_abs_drift"] = drift.max()
+
+            predictions, probability = score_features(tables[tier], model, n_top, active_res_index1)
+            row["top_n_overlap"] = len(set(predictions.resi_index0) & set(reference_predictions.resi_index0))
+            row["probability_spearman"] = probability.corr(reference_probability, method="spearman")
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    """Console script for the SASA tier calibration report."""
+    parser = argparse.ArgumentParser(description="Compare SASA tiers against the default tier.")
+    parser.add_argument("structures", nargs="+", help="Structure files or directories containing pdb files")
+    parser.add_argument("--tiers", nargs="+", default=None, choices=list(SASA_TIERS))
+    parser.add_argument("--reference-tier", default="default", choices=list(SASA_TIERS))
+    parser.add_argument("--model-path", default=None, help="Path to trained model, by default the packaged model")
+    parser.add_argument(
+        "--active-sites",
+        default=None,
+        help="csv with struct_name and active_res_index1 columns, by default active-sites.csv next to the structures",
+    )
+    parser.add_argument("--n-top", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed analyses per tier")
+    parser.add_argument("--output", default=None, help="Write the report to this csv file")
+    args = parser.parse_args()
+
+    struct_file_paths = []
+    active_sites = {}
+    for structure in args.structures:
+        path = pathlib.Path(structure)
+        struct_file_paths += sorted(path.glob("*.pdb")) if path.is_dir() else [path]
+        default_active_sites = (path if path.is_dir() else path.parent) / "active-sites.csv"
+        if args.active_sites is None and default_active_sites.exists():
+            active_sites.update(read_active_sites(default_active_sites))
+    if args.active_sites is not None:
+        active_sites.update(read_active_sites(args.active_sites))
+
+    # the model can not score structures without active sites
+    for path in struct_file_paths:
+        if path.stem not in active_sites:
+            print(f"Skipping {path}, no active sites given")
+    struct_file_paths = [path for path in struct_file_paths if path.stem in active_sites]
+
+    report = calibrate_sasa_tiers(
+        [str(path) for path in struct_file_paths],
+        active_sites,
+        tiers=args.tiers,
+        reference_tier=args.reference_tier,
+        model_path=args.model_path,
+        n_top=args.n_top,
+        n_repeats=args.repeats,
+    )
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+    print(report.groupby("sasa_tier")[["speedup", "top_n_overlap", "probability_spearman"]].mean())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -52,35 +52,44 @@ def load_model(filename):
     return model
 
 
-def predict_positions(df, model_path="models/gbt_classifier_v2.pkl", n_top=3, exclude_resi_index1=[]):
+def prepare_features(df, exclude_resi_index1=[]):
     """
-    Loads the model and applies it to the input dataframe.
-    Takes into account only the positive predictions.
-    Only the highest probability prediction for each loop_index0 is considered.
+    Excludes the requested residues and encodes the features for the model.
 
     Parameters
     ----------
-    df: input dataframe
-    model_path: path to trained model
-    n_top: the number of to positions to return
+    df: input dataframe, modified in place
     exclude_resi_index1: list of resi indices that should be excluded as predictions (usually active site residues)
 
     Returns
     -------
-    df_predictions: dataframe with n_top predictions
-    df_all: dataframe with all features
+    x: feature matrix for the model
     """
-    # Load the model
-    model = load_model(model_path)
     # recommended sites are resi_index0+1, so adjust exclude_resi_index1
     exclude_resi_index1 = [element - 1 for element in exclude_resi_index1]
     # Preprocess the data - exclude active sites and encode categories
     if exclude_resi_index1:
         df.drop(df[df["resi_index0"].isin(exclude_resi_index1)].index, inplace=True)
-    x = encode_categories(pd.DataFrame(df.drop(columns=["struct_name"])), replace=True).values
-    # Apply model to get labels and predicted probabilities
-    prediction_label = model.predict(x)
-    prediction_probability = model.predict_proba(x)
+    return encode_categories(pd.DataFrame(df.drop(columns=["struct_name"])), replace=True).values
+
+
+def rank_predictions(df, prediction_label, prediction_probability, n_top=3):
+    """
+    Adds the predicted probabilities to the dataframe and picks the n_top positions.
+    Takes into account only the positive predictions.
+    Only the highest probability prediction for each loop_index0 is considered.
+
+    Parameters
+    ----------
+    df: dataframe the predictions were made for, modified in place
+    prediction_label: predicted labels ("Y" or "N")
+    prediction_probability: predicted probabilities for N and Y
+    n_top: the number of to positions to return
+
+    Returns
+    -------
+    df_predictions: dataframe with n_top predictions
+    """
     # Add probabilities for N and Y to dataframe
     df["probability_N"] = prediction_probability[:, 0]
     df["probability_Y"] = prediction_probability[:, 1]
@@ -91,4 +100,32 @@ def predict_positions(df, model_path="models/gbt_classifier_v2.pkl", n_top=3, ex
         df_positive.groupby("loop_index0")["prediction_probability"].idxmax().sample(frac=1, random_state=2),
         ["resi_index0", "resi_dssp", "prediction_probability"],
     ].nlargest(n=n_top, columns=["prediction_probability"])
+    return df_predictions
+
+
+def predict_positions(df, model_path="models/gbt_classifier_v2.pkl", n_top=3, exclude_resi_index1=[]):
+    """
+    Loads the model and applies it to the input dataframe.
+    Takes into account only the positive predictions.
+    Only the highest probability prediction for each loop_index0 is considered.
+
+    Parameters
+    ----------
+    df: input dataframe
+    model_path: path to trained model
+    n_top: the number of to positions to return
+    exclude_resi_index1: list of resi indices that should be excluded as predictions (usually active site residues)
+
+    Returns
+    -------
+    df_predictions: dataframe with n_top predictions
+    df_all: dataframe with all features
+    """
+    # Load the model
+    model = load_model(model_path)
+    x = prepare_features(df, exclude_resi_index1)
+    # Apply model to get labels and predicted probabilities
+    prediction_label = model.predict(x)
+    prediction_probability = model.predict_proba(x)
+    df_predictions = rank_predictions(df, prediction_label, prediction_probability, n_top)
     return df_predictions, df
@@ -0,0 +1,328 @@
+"""
+Local prediction service.
+
+Keeps the model and recent structure analyses warm and batches concurrent scoring requests
+into single `predict_proba` calls. Only uses the standard library, run it with::
+
+    python -m insrtr.service --port 8150
+
+Endpoints
+---------
+POST /predict
+    JSON body with `struct_file_path` and `active_res_index1` and optionally `exclude_resi_index1`, `n_top`
+    and `sasa_tier`.
+    Returns the top predictions.
+GET /metrics
+    Queue depth, batch sizes, cache hits and latencies.
+GET /health
+    Returns {"status": "ok"}.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .analysis import SASA_TIERS, LoopAnalyzer
+from .model import load_model, prepare_features, rank_predictions
+
+
+class UnscorableRequestError(ValueError):
+    """The features of a request do not fit the model, so it can not be scored"""
+
+
+def analyze_structure_file(struct_file_path, active_res_index1=None, sasa_tier="default"):
+    """Analyzes a structure and returns the residue features table. Runs in a worker process."""
+    analyzer = LoopAnalyzer(struct_file_path, active_res_index1=active_res_index1, sasa_tier=sasa_tier)
+    return analyzer.analyze_structure()
+
+
+def is_int_list(value):
+    return isinstance(value, list) and all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+
+
+def validate_predict_request(request):
+    """Returns an error message for an invalid /predict request body or None if it is valid"""
+    if not isinstance(request, dict):
+        return "Expected a JSON object"
+    if not isinstance(request.get("struct_file_path"), str):
+        return "Expected struct_file_path"
+    # same as the notebook, predictions are only made with active sites
+    if not request.get("active_res_index1") or not is_int_list(request["active_res_index1"]):
+        return "Expected active_res_index1 as a non empty list of residue numbers"
+    if not is_int_list(request.get("exclude_resi_index1", [])):
+        return "Expected exclude_resi_index1 as a list of residue numbers"
+    n_top = request.get("n_top", 3)
+    if not isinstance(n_top, int) or isinstance(n_top, bool) or n_top < 1:
+        return "Expected n_top as a positive integer"
+    sasa_tier = request.get("sasa_tier", "default")
+    if not isinstance(sasa_tier, str) or sasa_tier not in SASA_TIERS:
+        return f"Unknown SASA tier {sasa_tier}, must be one of {list(SASA_TIERS)}"
+    return None
+
+
+class PredictionService:
+    """
+    Holds the warm model, the analysis cache and the batching queue.
+
+    Parameters
+    ----------
+    model_path: path to trained model, by default the packaged model
+    max_workers: number of processes used for structure analysis
+    cache_size: number of analyzed structures kept in memory
+    max_batch_size: maximum number of requests scored in one `predict_proba` call
+    max_batch_wait_s: how long to wait for more requests before scoring a batch
+    """
+
+    def __init__(self, model_path=None, max_workers=None, cache_size=32, max_batch_size=64, max_batch_wait_s=0.01):
+        if model_path is None:
+            from . import MODEL_NAME
+
+            model_path = pathlib.Path(__file__).parent / "models" / MODEL_NAME
+        self.model = load_model(model_path)
+        # forking after the executor threads running predict_proba exist can deadlock BLAS/OpenMP
+        self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("forkserver"))
+        self.cache_size = cache_size
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait_s = max_batch_wait_s
+
+        self._analyses = collections.OrderedDict()  # key -> future of the residue features table
+        self._queue = None
+        self._batch_task = None
+        self._pending_analyses = 0
+        self._latencies_s = collections.deque(maxlen=1000)
+        self._batch_sizes = collections.deque(maxlen=1000)
+        self._counts = collections.Counter()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._batch_task = asyncio.ensure_future(self._batch_worker())
+
+    async def stop(self):
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+        self.pool.shutdown(wait=False)
+
+    async def get_features(self, struct_file_path, active_res_index1=None, sasa_tier="default"):
+        """Returns a copy of the (cached) residue features table of the structure"""
+        active_res_index1 = sorted(active_res_index1 or [])
+        # the modification time is part of the key so changed files are reanalyzed
+        key = (
+            os.path.abspath(struct_file_path),
+            os.stat(struct_file_path).st_mtime_ns,
+            tuple(active_res_index1),
+            sasa_tier,
+        )
+
+        if key in self._analyses:
+            self._counts["cache_hits"] += 1
+            self._analyses.move_to_end(key)
+        else:
+            self._counts["cache_misses"] += 1
+            # store the future, so concurrent requests for the same structure share one analysis
+            loop = asyncio.get_running_loop()
+            self._analyses[key] = loop.run_in_executor(
+                self.pool, analyze_structure_file, struct_file_path, active_res_index1, sasa_tier
+            )
+            while len(self._analyses) > self.cache_size:
+                self._analyses.popitem(last=False)
+
+        future = self._analyses[key]
+        self._pending_analyses += 1
+        try:
+            table = await asyncio.shield(future)
+        except Exception:
+            # do not cache failures
+            if self._analyses.get(key) is future:
+                del self._analyses[key]
+            raise
+        finally:
+            self._pending_analyses -= 1
+        return table.copy()
+
+    async def predict(
+        self, struct_file_path, active_res_index1=None, exclude_resi_index1=None, n_top=3, sasa_tier="default"
+    ):
+        """Analyzes (or takes from cache) the structure and returns the n_top predictions"""
+        start = time.perf_counter()
+        df = await self.get_features(struct_file_path, active_res_index1, sasa_tier)
+        # categories are encoded per structure, so encoding must happen before batching
+        x = prepare_features(df, exclude_resi_index1 or [])
+        # a request the model can not score must fail alone and never enter a batch
+        if x.shape[1] != self.model.n_features_in_:
+            raise UnscorableRequestError(
+                f"Model expects {self.model.n_features_in_} features, got {x.shape[1]} (are active sites given?)"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, future))
+        prediction_probability = await future
+
+        prediction_label = self.model.classes_[np.argmax(prediction_probability, axis=1)]
+        df_predictions = rank_predictions(df, prediction_label, prediction_probability, n_top)
+        self._latencies_s.append(time.perf_counter() - start)
+        self._counts["requests"] += 1
+        return df_predictions
+
+    async def _batch_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_batch_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self._batch_sizes.append(len(batch))
+            try:
+                x = np.vstack([x for x, future in batch])
+                probabilities = await loop.run_in_executor(None, self.model.predict_proba, x)
+            except Exception as e:
+                for x, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # split the batch back into the individual requests
+            split_at = np.cumsum([len(x) for x, future in batch])[:-1]
+            for (x, future), probability in zip(batch, np.split(probabilities, split_at)):
+                if not future.done():
+                    future.set_result(probability)
+
+    def get_metrics(self):
+        latencies = np.array(self._latencies_s)
+        metrics = dict(
+            queue_depth=self._queue.qsize() if self._queue is not None else 0,
+            pending_analyses=self._pending_analyses,
+            cached_structures=len(self._analyses),
+            mean_batch_size=float(np.mean(self._batch_sizes)) if self._batch_sizes else None,
+            **self._counts,
+        )
+        if len(latencies):
+            metrics.update(
+                latency_mean_s=float(latencies.mean()),
+                latency_p50_s=float(np.percentile(latencies, 50)),
+                latency_p95_s=float(np.percentile(latencies, 95)),
+                latency_max_s=float(latencies.max()),
+            )
+        return metrics
+
+    async def handle_connection(self, reader, writer):
+        """Minimal HTTP/1.1 handler, one request per connection"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if len(request_line) < 2:
+                status, response = 400, dict(error="Malformed request")
+            else:
+                status, response = await self.route(request_line[0], request_line[1], body)
+        except Exception as e:
+            status, response = 500, dict(error=str(e))
+
+        payload = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+        writer.close()
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, dict(status="ok")
+        if method == "GET" and path == "/metrics":
+            return 200, self.get_metrics()
+        if method == "POST" and path == "/predict":
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                request = None
+            error = validate_predict_request(request)
+            if error:
+                return 400, dict(error=error)
+            struct_file_path = request["struct_file_path"]
+            if not os.path.isfile(struct_file_path):
+                return 404, dict(error=f"No such structure file: {struct_file_path}")
+            try:
+                df_predictions = await self.predict(
+                    struct_file_path,
+                    active_res_index1=request["active_res_index1"],
+                    exclude_resi_index1=request.get("exclude_resi_index1"),
+                    n_top=request.get("n_top", 3),
+                    sasa_tier=request.get("sasa_tier", "default"),
+                )
+            except UnscorableRequestError as e:
+                return 400, dict(error=str(e))
+            # report the recommended sites one based, same as in the notebook
+            predictions = [
+                dict(resi_index1=int(row.resi_index0) + 1, resi_dssp=str(row.resi_dssp), probability=float(row.prediction_probability))
+                for row in df_predictions.itertuples()
+            ]
+            return 200, dict(struct_file_path=struct_file_path, predictions=predictions)
+        return 404, dict(error=f"Unknown endpoint {method} {path}")
+
+
+async def serve(host="127.0.0.1", port=8150, **service_kwargs):
+    service = PredictionService(**service_kwargs)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"INSRTR prediction service listening on http://{host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        await service.stop()
+
+
+def main():
+    """Console script for the prediction service."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8150)
+    parser.add_argument("--model-path", default=None, help="Path to trained model, by default the packaged model")
+    parser.add_argument("--workers", type=int, default=None, help="Number of analysis processes")
+    parser.add_argument("--cache-size", type=int, default=32, help="Number of analyzed structures kept in memory")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-batch-wait-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(
+            serve(
+                args.host,
+                args.port,
+                model_path=args.model_path,
+                max_workers=args.workers,
+                cache_size=args.cache_size,
+                max_batch_size=args.max_batch_size,
+                max_batch_wait_s=args.max_batch_wait_ms / 1000,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
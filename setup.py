@@ -33,6 +33,8 @@ setup(
     entry_points={
         'console_scripts': [
             'insrtr=insrtr.cli:main',
+            'insrtr-service=insrtr.service:main',
+            'insrtr-calibrate-sasa=insrtr.calibration:main',
         ],
     },
     install_requires=requirements,
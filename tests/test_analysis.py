@@ -39,5 +39,18 @@ def test_loops_to_0_based():
     # TOOD test assertion if index goes below 0
 
 
+def test_insertion_index_mapping():
+    # insert of 3 residues before residue 5 (1 based), i.e. mutant residues 4, 5, 6 (0 based) are inserted
+    wt_seq = "ABCDEFGH"
+    mut_seq = insrtr.insert_sequence(wt_seq, 5, "xyz")
+    for wt_index0 in range(len(wt_seq)):
+        mut_index0 = insrtr.insertion_wt_to_mut_index0(wt_index0, 5, 3)
+        assert mut_seq[mut_index0] == wt_seq[wt_index0]
+        assert insrtr.insertion_mut_to_wt_index0(mut_index0, 5, 3) == wt_index0
+
+    for mut_index0 in (4, 5, 6):
+        assert insrtr.insertion_mut_to_wt_index0(mut_index0, 5, 3) is None
+
+
 if __name__ == "__main__":
     test_get_loops_from_annotation()
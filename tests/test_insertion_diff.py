@@ -0,0 +1,127 @@
+import pathlib
+
+import mdtraj as md
+import numpy as np
+import pandas as pd
+import pytest
+
+import insrtr
+
+DATA_DIR = pathlib.Path(__file__).parent.parent / "data" / "pdbs"
+MUT_DIR = DATA_DIR / "mut"
+# CAR_T_I193_P7_N8 is CAR_T_I193_P7 (535 residues) with the 28 residue N8 coiled coil added at the end
+WT_PATH = MUT_DIR / "CAR_T_I193_P7_unrelaxed_rank_1_model_1.pdb"
+MUT_PATH = MUT_DIR / "CAR_T_I193_P7_N8_unrelaxed_rank_1_model_1.pdb"
+ACTIVE_RES_INDEX1 = [100, 300]
+INDEX_COLUMNS = ["struct_name", "resi_index0", "resi_loop_index0", "loop_index0"]
+
+# TEVp with residues 101-110 (1 based) deleted is the wild type of a synthetic insert in the middle of the chain
+TEVP_PATH = DATA_DIR / "wt" / "TEVp.pdb"
+TEVP_INSERT_POSITION = 101
+TEVP_INSERT_LENGTH = 10
+TEVP_ACTIVE_SITES = [39, 74, 144]
+
+
+@pytest.fixture(scope="module")
+def analyses():
+    wt = insrtr.LoopAnalyzer(str(WT_PATH), active_res_index1=ACTIVE_RES_INDEX1)
+    wt.analyze_structure()
+
+    diff = insrtr.InsertionDiffAnalyzer(wt, str(MUT_PATH), one_based_position=536, insert_length=28)
+    diff.analyze_structure()
+
+    full = insrtr.LoopAnalyzer(str(MUT_PATH), active_res_index1=ACTIVE_RES_INDEX1)
+    full.analyze_structure()
+
+    return wt, diff, full
+
+
+@pytest.fixture(scope="module")
+def synthetic_analyses(tmp_path_factory):
+    traj = md.load(str(TEVP_PATH))
+    insert0 = range(TEVP_INSERT_POSITION - 1, TEVP_INSERT_POSITION - 1 + TEVP_INSERT_LENGTH)
+    wt_atoms = [atom.index for atom in traj.topology.atoms if atom.residue.index not in insert0]
+    wt_path = tmp_path_factory.mktemp("synthetic") / "TEVp_deletion.pdb"
+    traj.atom_slice(wt_atoms).save_pdb(str(wt_path))
+
+    wt_active_sites = [
+        insrtr.insertion_mut_to_wt_index0(resid - 1, TEVP_INSERT_POSITION, TEVP_INSERT_LENGTH) + 1
+        for resid in TEVP_ACTIVE_SITES
+    ]
+    wt = insrtr.LoopAnalyzer(str(wt_path), active_res_index1=wt_active_sites)
+    diff = insrtr.InsertionDiffAnalyzer(
+        wt, str(TEVP_PATH), one_based_position=TEVP_INSERT_POSITION, insert_length=TEVP_INSERT_LENGTH
+    )
+    diff.analyze_structure()
+
+    full = insrtr.LoopAnalyzer(str(TEVP_PATH), active_res_index1=TEVP_ACTIVE_SITES)
+    full.analyze_structure()
+
+    return wt, diff, full
+
+
+def assert_rows_match(rows, expected_rows, columns, rtol=1e-6):
+    numeric = [c for c in columns if pd.api.types.is_numeric_dtype(rows[c])]
+    other = [c for c in columns if c not in numeric]
+    pd.testing.assert_frame_equal(rows[other], expected_rows[other])
+    np.testing.assert_allclose(rows[numeric].astype(float), expected_rows[numeric].astype(float), rtol=rtol, atol=1e-6)
+
+
+def test_recomputed_rows_match_full_analysis(analyses):
+    wt, diff, full = analyses
+    recomputed = diff.recomputed_res_index0
+    diff_table = diff.residue_features_table
+    full_table = full.residue_features_table.set_index("resi_index0")
+
+    # only rows whose whole loop and neighbours were recomputed depend on nothing copied from the wild type
+    local_loops = [li for li, loop in enumerate(diff.loops0) if all(r in recomputed for r in range(loop[0] - 1, loop[-1] + 2))]
+    local_rows = diff_table[diff_table.loop_index0.isin(local_loops)].set_index("resi_index0")
+    local_rows = local_rows[local_rows.index.isin(full_table.index)]
+    assert len(local_rows) > 0
+
+    full_rows = full_table.loc[local_rows.index]
+    assert (local_rows.loop_length_AA == full_rows.loop_length_AA).all()
+    # the total surface differs, and DSSP counts to the active site span copied residues
+    columns = [
+        c
+        for c in local_rows.columns
+        if c not in INDEX_COLUMNS and not c.endswith("_percent_of_total_surface") and not c.startswith("resi_active_site_num_")
+    ]
+    pd.testing.assert_frame_equal(local_rows[columns], full_rows[columns], check_exact=False, rtol=1e-6)
+
+
+def test_copied_rows_match_full_analysis_of_mid_chain_insert(synthetic_analyses):
+    wt, diff, full = synthetic_analyses
+    diff_table = diff.residue_features_table.set_index("resi_index0")
+    copied = diff_table.loc[sorted(diff.copied_res_index0)]
+    # residues after the insert are shifted when copied from the wild type
+    assert (copied.index >= TEVP_INSERT_POSITION - 1 + TEVP_INSERT_LENGTH).any()
+
+    full_rows = full.residue_features_table.set_index("resi_index0").loc[copied.index]
+    columns = [c for c in copied.columns if c not in INDEX_COLUMNS]
+    assert_rows_match(copied, full_rows, columns)
+
+
+def test_copied_rows_have_same_sequence_as_full_analysis(analyses):
+    _, diff, full = analyses
+    copied = diff.residue_features_table.set_index("resi_index0").loc[sorted(diff.copied_res_index0)]
+    full_rows = full.residue_features_table.set_index("resi_index0").reindex(copied.index)
+    for c in ["resi_type", "prev_resi_type", "next_resi_type"]:
+        assert (copied[c] == full_rows[c]).all()
+
+
+def test_inserted_residues_have_nan_deltas(analyses):
+    _, diff, _ = analyses
+    deltas = diff.get_feature_deltas()
+    inserted = deltas[deltas.wt_resi_index0.isna()]
+    assert len(inserted) > 0
+    assert (inserted.resi_index0 >= 535).all()
+    delta_columns = [c for c in deltas.columns if c.endswith("_delta")]
+    assert inserted[delta_columns].isna().all().all()
+    assert not deltas[~deltas.wt_resi_index0.isna()][delta_columns].isna().all().all()
+
+
+def test_most_rows_are_copied(analyses):
+    _, diff, _ = analyses
+    # the saving comes from the copied rows, which skip the SASA and geometry calculations
+    assert len(diff.copied_res_index0) > 0.5 * len(diff.residue_features_table)
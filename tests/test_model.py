@@ -0,0 +1,41 @@
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import insrtr
+from insrtr.model import encode_categories, load_model
+
+WT_DIR = pathlib.Path(__file__).parent.parent / "data" / "pdbs" / "wt"
+MODEL_PATH = pathlib.Path(insrtr.__file__).parent / "models" / insrtr.MODEL_NAME
+
+
+def predict_positions_before_split(df, model_path, n_top=3, exclude_resi_index1=[]):
+    """predict_positions as it was before it was split into prepare_features and rank_predictions"""
+    model = load_model(model_path)
+    exclude_resi_index1 = [element - 1 for element in exclude_resi_index1]
+    if exclude_resi_index1:
+        df.drop(df[df["resi_index0"].isin(exclude_resi_index1)].index, inplace=True)
+    x = encode_categories(pd.DataFrame(df.drop(columns=["struct_name"])), replace=True).values
+    prediction_label = model.predict(x)
+    prediction_probability = model.predict_proba(x)
+    df["probability_N"] = prediction_probability[:, 0]
+    df["probability_Y"] = prediction_probability[:, 1]
+    df_positive = df[prediction_label == "Y"].rename(columns={"probability_Y": "prediction_probability"})
+    df_predictions = df_positive.loc[
+        df_positive.groupby("loop_index0")["prediction_probability"].idxmax().sample(frac=1, random_state=2),
+        ["resi_index0", "resi_dssp", "prediction_probability"],
+    ].nlargest(n=n_top, columns=["prediction_probability"])
+    return df_predictions, df
+
+
+def test_predict_positions_unchanged():
+    active_sites = [39, 74, 144]
+    df = insrtr.LoopAnalyzer(str(WT_DIR / "TEVp.pdb"), active_res_index1=active_sites).analyze_structure()
+
+    expected_predictions, expected_all = predict_positions_before_split(df.copy(), MODEL_PATH, exclude_resi_index1=active_sites)
+    predictions, df_all = insrtr.predict_positions(df.copy(), MODEL_PATH, exclude_resi_index1=active_sites)
+
+    pd.testing.assert_frame_equal(predictions, expected_predictions)
+    pd.testing.assert_frame_equal(df_all, expected_all)
+    assert not np.isin(predictions.resi_index0 + 1, active_sites).any()
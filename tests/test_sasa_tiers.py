@@ -0,0 +1,68 @@
+import pathlib
+
+import mdtraj as md
+import numpy as np
+
+import insrtr
+from insrtr.calibration import calibrate_sasa_tiers, read_active_sites
+
+DATA_DIR = pathlib.Path(__file__).parent.parent / "data" / "pdbs"
+TEVP_PATH = DATA_DIR / "wt" / "TEVp.pdb"
+TEVP_ACTIVE_SITES = [39, 74, 144]
+
+
+def test_default_tier_matches_atom_sums():
+    analyzer = insrtr.LoopAnalyzer(str(TEVP_PATH), active_res_index1=TEVP_ACTIVE_SITES)
+    table = analyzer.analyze_structure()
+    topology = analyzer.topology
+
+    for row in table.itertuples():
+        loop = analyzer.loops0[row.loop_index0]
+        loop_atoms = topology.select(f"resid {loop[0]} to {loop[-1]}")
+        resi_atoms = topology.select(f"resid {row.resi_index0}")
+        np.testing.assert_allclose(row.loop_sasa_A, sum(analyzer.sasa_atoms_A[loop_atoms]))
+        np.testing.assert_allclose(row.resi_sasa_A, sum(analyzer.sasa_atoms_A[resi_atoms]))
+
+
+def test_aggregate_atom_sasa_matches_residue_mode():
+    traj = md.load(str(TEVP_PATH))
+    sasa_atoms = md.shrake_rupley(traj, mode="atom")[0]
+    sasa_res = md.shrake_rupley(traj, mode="residue")[0]
+    np.testing.assert_allclose(insrtr.aggregate_atom_sasa(traj.topology, sasa_atoms), sasa_res, rtol=1e-5)
+
+
+def test_fast_tier_loop_analyzer():
+    analyzer = insrtr.LoopAnalyzer(str(TEVP_PATH), active_res_index1=TEVP_ACTIVE_SITES, sasa_tier="fast")
+    table = analyzer.analyze_structure()
+    assert analyzer.sasa_atoms_A is None
+    assert len(analyzer.sasa_res_A) == analyzer.topology.n_residues
+    assert len(table) > 0
+    assert not table[["loop_sasa_A", "resi_sasa_A", "resi_isolation_SASA_A"]].isna().any().any()
+
+
+def test_fast_tier_insertion_diff_analyzer():
+    mut_dir = DATA_DIR / "mut"
+    wt = insrtr.LoopAnalyzer(str(mut_dir / "CAR_T_I193_P7_unrelaxed_rank_1_model_1.pdb"), sasa_tier="fast")
+    diff = insrtr.InsertionDiffAnalyzer(
+        wt, str(mut_dir / "CAR_T_I193_P7_N8_unrelaxed_rank_1_model_1.pdb"), one_based_position=536, insert_length=28
+    )
+    table = diff.analyze_structure()
+    assert diff.sasa_tier == "fast"
+    assert diff.sasa_atoms_A is None
+    assert len(table) > 0
+    assert len(diff.get_feature_deltas()) == len(table)
+
+
+def test_calibrate_sasa_tiers():
+    active_sites = read_active_sites(DATA_DIR / "wt" / "active-sites.csv")
+    assert active_sites["TEVp"] == TEVP_ACTIVE_SITES
+
+    report = calibrate_sasa_tiers([str(TEVP_PATH)], active_sites, tiers=["fast"], n_repeats=2)
+    assert len(report) == 1
+    row = report.iloc[0]
+    assert row.struct_name == "TEVp"
+    assert row.sasa_tier == "fast"
+    assert row.speedup > 0
+    assert 0 <= row.top_n_overlap <= 3
+    assert -1 <= row.probability_spearman <= 1
+    assert "resi_sasa_A_mean_abs_drift" in report.columns
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import insrtr
+import insrtr.service
+from insrtr.service import PredictionService, UnscorableRequestError
+
+TEVP_PATH = pathlib.Path(__file__).parent.parent / "data" / "pdbs" / "wt" / "TEVp.pdb"
+TEVP_ACTIVE_SITES = [39, 74, 144]
+MODEL_PATH = pathlib.Path(insrtr.__file__).parent / "models" / insrtr.MODEL_NAME
+
+
+@pytest.fixture
+def service():
+    service = PredictionService(max_workers=1)
+    # threads instead of processes, so the analysis can be replaced in the tests
+    service.pool.shutdown()
+    service.pool = ThreadPoolExecutor(max_workers=1)
+    yield service
+    service.pool.shutdown()
+
+
+@pytest.fixture
+def analysis_calls(monkeypatch):
+    calls = []
+
+    def fake_analyze_structure_file(struct_file_path, active_res_index1=None, sasa_tier="default"):
+        calls.append(struct_file_path)
+        return pd.DataFrame(dict(resi_index0=[1, 2, 3]))
+
+    monkeypatch.setattr(insrtr.service, "analyze_structure_file", fake_analyze_structure_file)
+    return calls
+
+
+def test_batch_matches_single_predictions(service):
+    rng = np.random.default_rng(0)
+    xs = [rng.random((n, service.model.n_features_in_)) for n in (3, 1, 5, 2)]
+    service.max_batch_wait_s = 1.0
+
+    async def run():
+        await service.start()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for x in xs]
+        for x, future in zip(xs, futures):
+            service._queue.put_nowait((x, future))
+        results = await asyncio.gather(*futures)
+        await service.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert list(service._batch_sizes) == [len(xs)]
+    for x, probability in zip(xs, results):
+        np.testing.assert_allclose(probability, service.model.predict_proba(x))
+
+
+def test_cache_hit_and_mtime_miss(service, analysis_calls, tmp_path):
+    struct_file_path = tmp_path / "struct.pdb"
+    struct_file_path.write_text("")
+
+    async def run():
+        # cached futures belong to the event loop, so everything runs in one loop
+        await service.get_features(str(struct_file_path), [1, 2])
+        await service.get_features(str(struct_file_path), [1, 2])
+        assert len(analysis_calls) == 1
+        assert service._counts["cache_hits"] == 1
+
+        stat = os.stat(struct_file_path)
+        os.utime(struct_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        await service.get_features(str(struct_file_path), [1, 2])
+        assert len(analysis_calls) == 2
+        assert service._counts["cache_misses"] == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"not json",
+        b"[]",
+        b'"x"',
+        dict(active_res_index1=[1]),
+        dict(struct_file_path="x.pdb"),
+        dict(struct_file_path="x.pdb", active_res_index1=["1"]),
+        dict(struct_file_path="x.pdb", active_res_index1=[1], exclude_resi_index1=1),
+        dict(struct_file_path="x.pdb", active_res_index1=[1], n_top=0),
+        dict(struct_file_path="x.pdb", active_res_index1=[1], n_top="3"),
+        dict(struct_file_path="x.pdb", active_res_index1=[1], sasa_tier="slow"),
+        dict(struct_file_path="x.pdb", active_res_index1=[1], sasa_tier=["fast"]),
+    ],
+)
+def test_route_bad_request(service, body):
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+    status, response = asyncio.run(service.route("POST", "/predict", body))
+    assert status == 400
+    assert "error" in response
+
+
+def test_route_not_found(service, tmp_path):
+    body = json.dumps(dict(struct_file_path=str(tmp_path / "missing.pdb"), active_res_index1=[1])).encode()
+    status, response = asyncio.run(service.route("POST", "/predict", body))
+    assert status == 404
+
+    status, response = asyncio.run(service.route("GET", "/unknown", b""))
+    assert status == 404
+
+    status, response = asyncio.run(service.route("GET", "/health", b""))
+    assert status == 200
+
+
+@pytest.fixture(scope="module")
+def tevp_tables():
+    with_active_sites = insrtr.LoopAnalyzer(str(TEVP_PATH), active_res_index1=TEVP_ACTIVE_SITES).analyze_structure()
+    # without active sites the active site features are missing, so the model can not score it
+    without_active_sites = insrtr.LoopAnalyzer(str(TEVP_PATH)).analyze_structure()
+    return with_active_sites, without_active_sites
+
+
+@pytest.fixture
+def tevp_paths(monkeypatch, tmp_path, tevp_tables):
+    scorable_path = tmp_path / "scorable.pdb"
+    unscorable_path = tmp_path / "unscorable.pdb"
+    scorable_path.write_text("")
+    unscorable_path.write_text("")
+    tables = {str(scorable_path): tevp_tables[0], str(unscorable_path): tevp_tables[1]}
+
+    def fake_analyze_structure_file(struct_file_path, active_res_index1=None, sasa_tier="default"):
+        return tables[struct_file_path].copy()
+
+    monkeypatch.setattr(insrtr.service, "analyze_structure_file", fake_analyze_structure_file)
+    return str(scorable_path), str(unscorable_path)
+
+
+def test_concurrent_predictions(service, tevp_paths, tevp_tables):
+    scorable_path, unscorable_path = tevp_paths
+    service.max_batch_wait_s = 0.5
+    requests = [dict(n_top=3), dict(n_top=5, exclude_resi_index1=TEVP_ACTIVE_SITES), dict(n_top=1)]
+
+    async def run():
+        await service.start()
+        results = await asyncio.gather(
+            *[service.predict(scorable_path, TEVP_ACTIVE_SITES, **request) for request in requests],
+            service.predict(unscorable_path, TEVP_ACTIVE_SITES),
+            return_exceptions=True,
+        )
+        await service.stop()
+        return results
+
+    results = asyncio.run(run())
+
+    # the unscorable request fails alone and never enters the batch
+    assert isinstance(results[-1], UnscorableRequestError)
+    assert list(service._batch_sizes) == [len(requests)]
+    for request, df_predictions in zip(requests, results):
+        expected, _ = insrtr.predict_positions(
+            tevp_tables[0].copy(), MODEL_PATH, n_top=request["n_top"], exclude_resi_index1=request.get("exclude_resi_index1", [])
+        )
+        pd.testing.assert_frame_equal(df_predictions, expected)
+
+
+def test_http_round_trip(service, tevp_paths):
+    scorable_path, _ = tevp_paths
+
+    async def run():
+        await service.start()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        body = json.dumps(
+            dict(struct_file_path=scorable_path, active_res_index1=TEVP_ACTIVE_SITES, exclude_resi_index1=TEVP_ACTIVE_SITES, n_top=2)
+        ).encode()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /predict HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+        response = await reader.read()  # the server closes the connection after the response
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+        return response
+
+    head, _, payload = asyncio.run(run()).partition(b"\r\n\r\n")
+    assert head.split(b"\r\n")[0] == b"HTTP/1.1 200 OK"
+    response = json.loads(payload)
+    assert response["struct_file_path"] == scorable_path
+    assert 0 < len(response["predictions"]) <= 2
+    assert all(prediction["resi_index1"] not in TEVP_ACTIVE_SITES for prediction in response["predictions"])